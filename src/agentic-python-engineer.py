@@ -1,20 +1,4 @@
-def get_context_functions(self, failed_func_name: str, traceback_str: str) -> Dict[str, str]:
-        """Get source code for all functions in the call stack for context"""
-        context_functions = {}
-        tb_functions = self.extract_functions_from_traceback(traceback_str)
-        current_module = sys.modules[inspect.getmodule(inspect.stack()[1][0]).__name__]
-        
-        for name in tb_functions:
-            if hasattr(current_module, name):
-                func_obj = getattr(current_module, name)
-                if callable(func_obj):
-                    try:
-                        source = inspect.getsource(func_obj)
-                        context_functions[name] = source
-                    except Exception as e:
-                        context_functions[name] = f"# Could not retrieve source: {e}"
-        
-        return context_functions#!/usr/bin/env python3
+#!/usr/bin/env python3
 """
 Agentic Python Engineer (APE) - Function Management Decorator
 A decorator that allows APE to automatically fix failing functions using AI.
@@ -22,15 +6,225 @@ A decorator that allows APE to automatically fix failing functions using AI.
 
 import os
 import sys
-import requests
+import time
 import json
-import traceback
-import inspect
-import ast
+import io
+import linecache
 import re
+import types
+import weakref
+from collections import OrderedDict
 from enum import Enum
-from functools import wraps
-from typing import Dict, Callable, Optional, Any
+from typing import TYPE_CHECKING, Dict, Callable, Mapping, Optional, Any, Protocol
+
+if TYPE_CHECKING:
+    import asyncio  # Only for annotations; imported where it's used so startup doesn't pay for it
+
+# orjson is optional; it encodes/decodes LLM payloads in C straight to and from bytes
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# Strips line numbers from traceback frames so cosmetic edits still hit the fix cache
+_TB_LINENO_RE = re.compile(r', line \d+')
+
+# Matches the function name on each frame line of a standard CPython traceback
+_TB_FUNC_RE = re.compile(r'^\s*File "[^"]+", line \d+, in (\w+)', re.MULTILINE)
+
+# Frames of traceback sent to the LLM (and scanned for context functions) per failure
+_TB_LIMIT = 10
+
+# Captures the info string and body of each code fence in an LLM reply
+_FENCE_RE = re.compile(r'^```[ \t]*([\w+-]*)[^\n]*\n(.*?)^```', re.DOTALL | re.MULTILINE)
+
+# Fence info strings that mark Python code (untagged fences included)
+_PY_FENCE_TAGS = frozenset(('', 'python', 'py', 'python3'))
+
+# Reply APE gives when a failure needs a human rather than a rewrite
+_CANNOT_FIX_MARKER = "🥹👉👈 I can't fix this one:"
+
+# Splits a batched reply into its numbered code fences
+_BATCH_FENCE_RE = re.compile(r'^\s*(\d+)\.\s*```python\n(.*?)```', re.DOTALL | re.MULTILINE)
+
+# Numbered sections of a batched reply that APE declined to fix
+_BATCH_CANNOT_FIX_RE = re.compile(r'^\s*(\d+)\.\s*(' + re.escape(_CANNOT_FIX_MARKER) + r'.*)$', re.MULTILINE)
+
+_BATCH_PROMPT_HEADER = """Several @ape_managed functions failed at the same time. Each numbered section below is an independent repair request.
+
+This replaces the single ```python fence described in the Output Format section. Reply with numbered code fences 1./2./... - one per section, in order:
+
+1. ```python
+<fixed function for section 1>
+```
+2. ```python
+<fixed function for section 2>
+```
+
+If you cannot fix a section, put the cannot-fix line on its number instead of a fence, e.g.:
+
+3. """ + _CANNOT_FIX_MARKER + """ [explanation of what needs to be fixed by a human]
+
+"""
+
+# Stable instructions sent ahead of every fix request. Vendor prompt caches
+# (Anthropic cache_control, OpenAI automatic caching) only kick in for an
+# identical prefix of at least 1024 tokens, so keep this text unchanging and
+# put anything failure-specific in the user message instead.
+SYSTEM_PREFIX = """You are APE, the Agentic Python Engineer. You repair individual Python functions that have failed at runtime inside a running program. Each request gives you the error details, the source of the failed function, and the source of other functions from the call stack. Rewrite ONLY the failed function so that it no longer fails.
+
+## Requirements
+
+- The function is decorated with `@ape_managed`
+- Keep the same function name and general purpose
+- The API endpoint might be fake/broken - you can replace it with a real working one
+- Add proper error handling and validation
+- Maintain any existing comments if possible
+- Consider the data flow and expectations from context functions
+- Return ONLY the fixed function definition (including the `@ape_managed` decorator)
+
+## Important Notes
+
+- Analyze the full call stack context to understand what this function should return
+- Consider how this function fits into the larger program flow
+- If the error is due to a missing dependency, suggest a working alternative
+- If the error is due to invalid data, add appropriate validation
+- Maintain backward compatibility with the function's expected interface
+
+## Special Instructions
+
+**If you cannot fix the function** - because there is a bad setting, a missing environment variable, or the error is not actually occurring in the function itself - return exactly this format:
+
+`🥹👉👈 I can't fix this one: [explanation of what needs to be fixed by a human]`
+
+This should only be used when the problem is external to the function logic itself (like missing API keys, wrong environment variables, infrastructure issues, etc.).
+
+## Output Format
+
+Provide ONLY the corrected function code inside a single ```python fence, without any additional explanation. The function should be ready to replace the broken one directly: it is executed in the namespace of its original module and swapped in while the program keeps running.
+
+## Python Style Guide
+
+The replacement function is dropped straight into someone else's module, so it must read like the code around it.
+
+### Structure
+- Define exactly one top-level function, with the same name and the same parameters, defaults and keyword arguments as the original
+- Keep `async def` functions asynchronous and plain functions synchronous
+- Do not add module-level statements, classes, or helper functions outside the fixed function; nest small helpers inside it if you need them
+- Keep the original docstring, updating it only if the behaviour genuinely changes
+- Preserve the shape of the return value callers expect, including its type, keys and units
+
+### Imports and names
+- Rely on names the original module already imports wherever possible
+- If a new standard-library import is unavoidable, import it inside the function body
+- Never depend on third-party packages the original function did not already use
+- Do not shadow built-ins or module-level names the rest of the program relies on
+- Use descriptive snake_case names for local variables
+
+### Error handling
+- Catch the narrowest exception type that describes the failure you are handling
+- Never use a bare `except:`, and never silently swallow an exception without a fallback value or a clear message
+- Validate inputs that come from outside the function (arguments, network responses, files) before indexing into them
+- Prefer `dict.get` with an explicit default, or an explicit membership check, over assuming a key exists
+- When a network call is involved, pass an explicit timeout and call `raise_for_status()` or check the status code
+- If a sensible fallback value exists, return it rather than raising; otherwise raise an exception with a message explaining what went wrong
+
+### Behaviour
+- Never introduce side effects the original did not have: no writing files, no deleting data, no spawning processes, no changing global state
+- Do not read or print secrets, API keys or environment variables the original did not use
+- Do not add sleeps, infinite loops or retry loops without a bound
+- Keep any existing `print` or logging output the caller may depend on
+- Keep the fix minimal: change what is needed to stop the failure and leave the rest of the logic as it was
+
+### Performance and concurrency
+- The function may be called many times after it is fixed, so avoid expensive work that the original did not do
+- Do not load large files, models or datasets inside the function unless the original already did
+- Do not cache results in module globals; if caching is genuinely needed, keep it local to the function
+- Functions may run from several threads or event-loop tasks at once, so do not rely on shared mutable state
+- In `async def` functions, never call blocking network or file APIs; use the awaitable equivalents the module already uses
+- Keep the computational complexity of the original unless the failure is caused by it
+
+### Formatting
+- Follow PEP 8: four-space indentation, lines under 100 characters, no trailing whitespace
+- Use f-strings for string formatting
+- Keep existing type hints and add them to new parameters only if the original already used them
+- Add a short comment next to any non-obvious change explaining why it fixes the failure
+"""
+
+
+# Source of each function object seen so far. A hot-swap creates a new
+# function object, so entries never go stale and die with their function.
+_SOURCE_CACHE: "weakref.WeakKeyDictionary[Callable, str]" = weakref.WeakKeyDictionary()
+
+
+def _json_dumps(obj: Any) -> bytes:
+    """Serialize a request body, with orjson when available"""
+    if orjson is not None:
+        return orjson.dumps(obj)
+    return json.dumps(obj).encode('utf-8')
+
+
+def _json_loads(data) -> Any:
+    """Parse a response body or stream event, with orjson when available"""
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
+
+
+def _stream_delta_text(event: Dict[str, Any]) -> str:
+    """Text carried by one streamed event, for Anthropic or OpenAI-style streams"""
+    if event.get('type') == 'content_block_delta':
+        return event.get('delta', {}).get('text', '')
+    choices = event.get('choices')
+    if choices:
+        return choices[0].get('delta', {}).get('content') or ''
+    return ''
+
+
+# inspect.CO_COROUTINE, spelled out so the decorator doesn't need inspect at import time
+_CO_COROUTINE = 0x80
+
+
+def _is_coroutine_function(func: Callable) -> bool:
+    """inspect.iscoroutinefunction for plain functions, without importing inspect/asyncio"""
+    code = getattr(func, '__code__', None)
+    return code is not None and bool(code.co_flags & _CO_COROUTINE)
+
+
+def _message_text(body: Dict[str, Any]) -> str:
+    """Reply text of a complete (non-streamed) Anthropic or OpenAI-style response body"""
+    if 'content' in body:
+        return body['content'][0]['text']
+    return body['choices'][0]['message']['content']
+
+
+def _getsource(obj: Any) -> str:
+    """inspect.getsource, read from disk only the first time a given function is seen"""
+    try:
+        return _SOURCE_CACHE[obj]
+    except (KeyError, TypeError):
+        pass
+    
+    import inspect
+    source = inspect.getsource(obj)
+    try:
+        _SOURCE_CACHE[obj] = source
+    except TypeError:
+        pass  # Not weak-referenceable, so just don't cache it
+    return source
+
+
+# Fallback per-failure prompt, used when no template file is available
+_PROMPT_TMPL = """Please fix the failing @ape_managed function below.
+
+ERROR DETAILS:
+{error_info}
+
+FAILED FUNCTION SOURCE:
+```python
+{failed_function_source}
+```
+{context_section}"""
 
 
 class ApeMode(Enum):
@@ -39,34 +233,299 @@ class ApeMode(Enum):
     APE_SUPERVISED = "ape_supervised"  # Log suggestion, manual replacement
 
 
+# APE_MODE value -> mode, built once instead of via ApeMode(...) and try/except
+_MODE_MAP = {m.value: m for m in ApeMode}
+
+
 class ApeManagerError(Exception):
     """Custom exception for APE Manager related errors"""
-    pass
+    __slots__ = ()
 
 
 class ApeCannotFixError(Exception):
     """Exception raised when APE cannot fix a function and human intervention is required"""
-    pass
+    __slots__ = ()
+
+
+class CacheBackend(Protocol):
+    """Storage interface for previously generated function fixes"""
+    
+    def get(self, key: str) -> Optional[str]:
+        ...
+    
+    def set(self, key: str, value: str, ttl: Optional[int] = None) -> None:
+        ...
+
+
+class InMemoryCacheBackend:
+    """Process-local LRU cache of function fixes"""
+    
+    def __init__(self, maxsize: int = 128):
+        self.maxsize = maxsize
+        self._entries: "OrderedDict[str, tuple]" = OrderedDict()
+    
+    def get(self, key: str) -> Optional[str]:
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        value, expires_at = entry
+        if expires_at is not None and expires_at < time.monotonic():
+            del self._entries[key]
+            return None
+        self._entries.move_to_end(key)
+        return value
+    
+    def set(self, key: str, value: str, ttl: Optional[int] = None) -> None:
+        expires_at = time.monotonic() + ttl if ttl is not None else None
+        self._entries[key] = (value, expires_at)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+
+
+class DiskCacheBackend:
+    """Persistent cache of function fixes backed by the `diskcache` package"""
+    
+    def __init__(self, path: str):
+        import diskcache
+        self._cache = diskcache.Cache(path)
+    
+    def get(self, key: str) -> Optional[str]:
+        return self._cache.get(key)
+    
+    def set(self, key: str, value: str, ttl: Optional[int] = None) -> None:
+        self._cache.set(key, value, expire=ttl)
+
+
+class SemanticFixCache:
+    """
+    Reuses fixes for failures of the same function, with the same error type, whose
+    signatures are near-duplicates of earlier ones.
+    Needs the optional numpy and sentence-transformers packages.
+    """
+    
+    def __init__(self, path: str, threshold: float = 0.92, model_name: str = 'all-MiniLM-L6-v2'):
+        import numpy
+        import sentence_transformers  # noqa: F401 - fail now rather than on first lookup
+        
+        self._np = numpy
+        self.path = path
+        self.threshold = threshold
+        self.model_name = model_name
+        self._model = None
+        self._embeddings_file = os.path.join(path, 'embeddings.npy')
+        self._entries_file = os.path.join(path, 'entries.json')
+        
+        # Rows are unit-normalized embeddings; entries[i] is (func_name, err_type, fixed_code) for row i
+        self._matrix = None
+        self._entries: list = []
+        if os.path.exists(self._embeddings_file) and os.path.exists(self._entries_file):
+            with open(self._entries_file, 'r', encoding='utf-8') as f:
+                entries = [tuple(entry) for entry in json.load(f)]
+            # Indexes from before error types were recorded embedded whole prompts; don't mix them in
+            if all(len(entry) == 3 for entry in entries):
+                self._matrix = numpy.load(self._embeddings_file)
+                self._entries = entries
+    
+    def _embed(self, text: str):
+        """Embed text with the local model, loading it on first use"""
+        if self._model is None:
+            from sentence_transformers import SentenceTransformer
+            self._model = SentenceTransformer(self.model_name)
+        embedding = self._model.encode(text, normalize_embeddings=True).astype(self._np.float32)
+        
+        if self._matrix is not None and self._matrix.shape[1] != embedding.shape[0]:
+            # Saved with a different model, so none of the stored rows are comparable
+            print("⚠️ Semantic fix cache was built with a different embedding model. Starting it afresh.")
+            self._matrix = None
+            self._entries = []
+        return embedding
+    
+    def get(self, func_name: str, err_type: str, signature: str) -> Optional[tuple]:
+        """
+        Return (fixed_code, similarity) of the closest earlier fix for the same
+        function and error type, if close enough
+        """
+        if self._matrix is None:
+            return None
+        np = self._np
+        
+        query = self._embed(signature)
+        if self._matrix is None:
+            return None
+        
+        # Unit vectors, so one matrix-vector product gives every cosine similarity at once
+        similarities = self._matrix @ query
+        same_failure = np.fromiter(
+            (name == func_name and kind == err_type for name, kind, _ in self._entries), dtype=bool
+        )
+        similarities = np.where(same_failure, similarities, -1.0)
+        
+        best = int(np.argmax(similarities))
+        if similarities[best] < self.threshold:
+            return None
+        return self._entries[best][2], float(similarities[best])
+    
+    def set(self, func_name: str, err_type: str, signature: str, fixed_code: str) -> None:
+        """Remember a fix and persist the index"""
+        np = self._np
+        embedding = self._embed(signature)[np.newaxis, :]
+        self._matrix = embedding if self._matrix is None else np.vstack([self._matrix, embedding])
+        self._entries.append((func_name, err_type, fixed_code))
+        self._save()
+    
+    def remove(self, func_name: str, fixed_code: str) -> None:
+        """Forget a fix that turned out not to work, and persist the index"""
+        keep = [i for i, (name, _, code) in enumerate(self._entries)
+                if name != func_name or code != fixed_code]
+        if len(keep) == len(self._entries):
+            return
+        self._entries = [self._entries[i] for i in keep]
+        self._matrix = self._matrix[keep] if keep else None
+        self._save()
+    
+    def _save(self) -> None:
+        """Write the index to disk"""
+        os.makedirs(self.path, exist_ok=True)
+        if self._matrix is None:
+            for path in (self._embeddings_file, self._entries_file):
+                if os.path.exists(path):
+                    os.remove(path)
+            return
+        self._np.save(self._embeddings_file, self._matrix)
+        with open(self._entries_file, 'w', encoding='utf-8') as f:
+            json.dump(self._entries, f)
+
+
+class FixBatcher:
+    """Coalesces fix requests that arrive close together into a single LLM call"""
+    
+    def __init__(self, send: Callable, window: float = 0.25, max_batch: int = 8,
+                 tokens_per_fix: int = 1500, max_tokens: int = 4096):
+        # send(prompt, max_tokens) -> reply text
+        self._send = send
+        self.window = window
+        self.max_batch = max_batch
+        self.tokens_per_fix = tokens_per_fix
+        # The model's output limit, which one batched reply has to fit in
+        self.max_tokens = max_tokens
+        self._loop = None
+        self._queue: Optional["asyncio.Queue"] = None
+        self._worker: Optional["asyncio.Task"] = None
+        # Batches in flight; the loop only keeps weak references to tasks
+        self._dispatches: set = set()
+    
+    async def submit(self, func_name: str, prompt_body: str) -> Optional[str]:
+        """Queue a fix prompt and wait for its share of the batched reply"""
+        import asyncio
+        loop = asyncio.get_running_loop()
+        if self._loop is not loop or self._worker is None or self._worker.done():
+            # Queues and tasks are bound to a loop, so start fresh for each new one
+            self._loop = loop
+            self._queue = asyncio.Queue()
+            self._worker = asyncio.create_task(self._run())
+        
+        future = loop.create_future()
+        await self._queue.put((func_name, prompt_body, future))
+        return await future
+    
+    async def _run(self) -> None:
+        """
+        Collect requests for up to `window` seconds, `max_batch` items, or as many
+        as fit in the output token limit, then send them
+        """
+        import asyncio
+        loop = asyncio.get_running_loop()
+        max_items = max(1, min(self.max_batch, self.max_tokens // self.tokens_per_fix))
+        while True:
+            batch = [await self._queue.get()]
+            deadline = loop.time() + self.window
+            while len(batch) < max_items:
+                remaining = deadline - loop.time()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self._queue.get(), remaining))
+                except asyncio.TimeoutError:
+                    break
+            # Dispatched in the background so the next batch can collect while this one is sent
+            task = asyncio.create_task(self._dispatch(batch))
+            self._dispatches.add(task)
+            task.add_done_callback(self._dispatches.discard)
+    
+    async def _dispatch(self, batch: list) -> None:
+        """Send one combined prompt and route each numbered answer to its future"""
+        if len(batch) == 1:
+            prompt = batch[0][1]
+        else:
+            names = ', '.join(func_name for func_name, _, _ in batch)
+            print(f"📦 Batching {len(batch)} fix requests into one APE call: {names}")
+            sections = [f"{i}. {prompt_body}" for i, (_, prompt_body, _) in enumerate(batch, 1)]
+            prompt = _BATCH_PROMPT_HEADER + "\n\n".join(sections)
+        
+        try:
+            reply = await self._send(prompt, min(self.tokens_per_fix * len(batch), self.max_tokens))
+        except Exception as e:
+            for _, _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+        
+        if len(batch) == 1:
+            results = {1: reply}
+        else:
+            results = {int(num): text for num, text in _BATCH_CANNOT_FIX_RE.findall(reply)}
+            results.update((int(num), code) for num, code in _BATCH_FENCE_RE.findall(reply))
+        
+        for i, (_, _, future) in enumerate(batch, 1):
+            if not future.done():
+                future.set_result(results.get(i))
 
 
 class ApeManager:
     """Manages APE-decorated functions and their repair process"""
     
+    __slots__ = (
+        'managed_functions', 'api_url', 'api_key', 'model', 'mode', 'prompt_template_path',
+        '_headers', '_payload_base', 'cache', 'semantic_cache', 'batcher', '_session', '_aclient',
+        '_aclient_loop', 'max_output_tokens',
+        '_caches_ready', '_pending_fixes', '_ast_cache', '_code_cache', '_backed_up',
+        '_status_dirty', '_status_cache', '_prompt_template_cached'
+    )
+    
     def __init__(self):
         self.managed_functions: Dict[str, Callable] = {}
         self._load_config()
+        # Caches are opened on the first failure, not when the first function is decorated
+        self.cache: Optional[CacheBackend] = None
+        self.semantic_cache: Optional[SemanticFixCache] = None
+        self._caches_ready = False
+        # func name -> (cache_key, failure, fixed_code, is_new), until settle_fix() hears how the retry went
+        self._pending_fixes: Dict[str, tuple] = {}
+        
+        self._session = None
+        self._aclient = None
+        self._aclient_loop = None
+        self.batcher = FixBatcher(self._send_prompt_async, max_tokens=self.max_output_tokens)
+        self._ast_cache: Dict[str, tuple] = {}
+        self._code_cache: Dict[bytes, types.CodeType] = {}
+        self._backed_up: set = set()
+        self._status_dirty = True
+        self._status_cache: Optional[Mapping[str, Any]] = None
+        self._prompt_template_cached: Optional[str] = None
     
     def _load_config(self) -> None:
         """Load configuration from environment variables"""
         self.api_url = os.getenv('APE_API_URL')
         self.api_key = os.getenv('APE_API_KEY')
         self.model = os.getenv('APE_MODEL', 'claude-3-sonnet-20240229')
+        # Output tokens the model allows per reply (4096 for the default model)
+        self.max_output_tokens = int(os.getenv('APE_MAX_OUTPUT_TOKENS', '4096'))
         
         # Load mode configuration
         mode_str = os.getenv('APE_MODE', 'FULL_BANANAS').upper()
-        try:
-            self.mode = ApeMode(mode_str.lower())
-        except ValueError:
+        self.mode = _MODE_MAP.get(mode_str.lower())
+        if self.mode is None:
             print(f"⚠️ Invalid APE_MODE '{mode_str}'. Using FULL_BANANAS.")
             self.mode = ApeMode.FULL_BANANAS
         
@@ -85,39 +544,178 @@ class ApeManager:
                 "Please set it to your LLM service API key"
             )
         
+        # Built once here rather than for every request
+        self._headers = {
+            'Content-Type': 'application/json',
+            'x-api-key': self.api_key
+        }
+        self._payload_base = {"model": self.model, "max_tokens": 1500}
+        if 'anthropic' in self.api_url:
+            # Mark the instructions cacheable so only the failure details are billed in full
+            self._payload_base["system"] = [
+                {
+                    "type": "text",
+                    "text": SYSTEM_PREFIX,
+                    "cache_control": {"type": "ephemeral"}
+                }
+            ]
+        
         print(f"✅ APE Manager configured with endpoint: {self.api_url}")
         print(f"🐒 APE Mode: {self.mode.value.upper()}")
         print(f"📝 Prompt template: {self.prompt_template_path}")
     
+    def _create_cache(self) -> CacheBackend:
+        """Create the fix cache, falling back to memory if diskcache is unavailable or unusable"""
+        cache_dir = os.getenv('APE_CACHE_DIR', '.ape_cache')
+        try:
+            return DiskCacheBackend(path=cache_dir)
+        except ImportError:
+            print("⚠️ diskcache not installed. Using in-memory fix cache.")
+        except Exception as e:
+            # e.g. a read-only working directory for the default relative path
+            print(f"⚠️ Couldn't open fix cache at '{cache_dir}': {e}. Using in-memory fix cache.")
+        return InMemoryCacheBackend()
+    
+    def _create_semantic_cache(self) -> Optional[SemanticFixCache]:
+        """Create the opt-in similarity cache (APE_SEMANTIC_CACHE=1), if its dependencies exist"""
+        if os.getenv('APE_SEMANTIC_CACHE', '').lower() not in ('1', 'true', 'yes'):
+            return None
+        
+        cache_dir = os.getenv('APE_CACHE_DIR', '.ape_cache')
+        threshold = float(os.getenv('APE_SEMANTIC_THRESHOLD', '0.92'))
+        try:
+            cache = SemanticFixCache(os.path.join(cache_dir, 'semantic'), threshold=threshold)
+        except ImportError:
+            print("⚠️ APE_SEMANTIC_CACHE needs numpy and sentence-transformers. Semantic cache disabled.")
+            return None
+        except Exception as e:
+            print(f"⚠️ Couldn't load semantic fix cache: {e}. Semantic cache disabled.")
+            return None
+        print(f"🧠 Semantic fix cache enabled (threshold {threshold})")
+        return cache
+    
+    def _ensure_caches(self) -> None:
+        """Create the fix caches the first time one is needed"""
+        if not self._caches_ready:
+            self.cache = self._create_cache()
+            self.semantic_cache = self._create_semantic_cache()
+            self._caches_ready = True
+    
+    def _lookup_cached_fix(self, func_name: str, cache_key: str, failure: tuple) -> Optional[str]:
+        """Look for a reusable fix, exact match first and then by similarity"""
+        self._ensure_caches()
+        try:
+            cached_fix = self.cache.get(cache_key)
+        except Exception as e:
+            # A broken cache must not stand in for the user's error; ask the LLM instead
+            print(f"⚠️ Couldn't read fix cache: {e}")
+            cached_fix = None
+        if cached_fix:
+            print(f"🍌 Reusing cached fix for '{func_name}'")
+            return cached_fix
+        
+        if self.semantic_cache is not None:
+            try:
+                match = self.semantic_cache.get(func_name, *failure)
+            except Exception as e:
+                # Loading the model can fail (e.g. no network for the download); ask the LLM instead
+                print(f"⚠️ Couldn't search semantic fix cache: {e}")
+                match = None
+            if match:
+                fixed_code, similarity = match
+                print(f"🧠 Reusing fix from a similar failure of '{func_name}' (similarity {similarity:.2f})")
+                # Already in the semantic cache; only the exact key is new
+                self._pending_fixes[func_name] = (cache_key, failure, fixed_code, False)
+                return fixed_code
+        
+        return None
+    
+    def _store_fix(self, func_name: str, cache_key: str, failure: tuple, fixed_code: str,
+                   is_new: bool = True) -> None:
+        """Remember a fix in every enabled cache"""
+        self._ensure_caches()
+        try:
+            self.cache.set(cache_key, fixed_code, ttl=3600)
+        except Exception as e:
+            # The repair itself worked; losing its cache entry only costs a later LLM call
+            print(f"⚠️ Couldn't update fix cache: {e}")
+        if is_new and self.semantic_cache is not None:
+            try:
+                self.semantic_cache.set(func_name, *failure, fixed_code)
+            except Exception as e:
+                print(f"⚠️ Couldn't update semantic fix cache: {e}")
+    
+    def settle_fix(self, func_name: str, succeeded: bool) -> None:
+        """
+        Cache the fix last handed out for func_name if the retried call succeeded,
+        otherwise drop it. A fix that doesn't work is never cached, so a later run asks again.
+        """
+        pending = self._pending_fixes.pop(func_name, None)
+        if pending is None:
+            return
+        if succeeded:
+            self._store_fix(func_name, *pending)
+        elif not pending[3] and self.semantic_cache is not None:
+            # A similar failure's fix didn't carry over to this one; stop offering it
+            try:
+                self.semantic_cache.remove(func_name, pending[2])
+            except Exception as e:
+                print(f"⚠️ Couldn't update semantic fix cache: {e}")
+    
+    def _fix_cache_key(self, failed_function_source: str, error: Exception,
+                       traceback_str: str, context_functions: Dict[str, str]) -> str:
+        """Build the cache key identifying a specific failure of a specific function"""
+        signature = json.dumps({
+            "model": self.model,
+            "src": failed_function_source,
+            "err_type": type(error).__name__,
+            "err_msg": str(error),
+            "tb": _TB_LINENO_RE.sub('', traceback_str),
+            "ctx": context_functions
+        }, sort_keys=True)
+        import hashlib
+        return hashlib.sha256(signature.encode()).hexdigest()
+    
     def register_function(self, func: Callable) -> None:
         """Register a function as APE-managed"""
-        self.managed_functions[func.__name__] = func
+        self.managed_functions[sys.intern(func.__name__)] = func
+        self._status_dirty = True
+    
+    def get_status(self) -> Mapping[str, Any]:
+        """Read-only status view, rebuilt only after the registry changes"""
+        if self._status_dirty or self._status_cache is None:
+            self._status_cache = types.MappingProxyType({
+                'api_url': self.api_url,
+                'model': self.model,
+                'mode': self.mode.value,
+                'prompt_template_path': self.prompt_template_path,
+                'managed_function_count': len(self.managed_functions),
+                'managed_functions': tuple(self.managed_functions)
+            })
+            self._status_dirty = False
+        return self._status_cache
     
     def get_function_source(self, func: Callable) -> Optional[str]:
         """Extract the source code of a specific function"""
         try:
-            return inspect.getsource(func)
+            return _getsource(func)
         except Exception as e:
             print(f"🤔 Couldn't get source for {func.__name__}: {e}")
             return None
     
     def extract_functions_from_traceback(self, tb_str: str) -> list:
-        """Extract all function names from a traceback string"""
-        function_names = []
-        lines = tb_str.split('\n')
-        
-        for line in lines:
-            if 'in ' in line and line.strip().startswith('File'):
-                continue
-            elif line.strip() and not line.startswith(' ') and not line.startswith('Traceback'):
-                match = re.search(r'in (\w+)', line)
-                if match:
-                    function_names.append(match.group(1))
-        
-        return list(set(function_names))
+        """Extract all function names from a traceback string, in call order"""
+        # Interned, so later lookups by these names hit the dict's identity fast path
+        return list(dict.fromkeys(sys.intern(name) for name in _TB_FUNC_RE.findall(tb_str)))
     
     def load_prompt_template(self) -> str:
-        """Load the prompt template from external file"""
+        """Load the prompt template from external file, reading it only once"""
+        if self._prompt_template_cached is None:
+            self._prompt_template_cached = self._read_prompt_template()
+        return self._prompt_template_cached
+    
+    def _read_prompt_template(self) -> str:
+        """Read the prompt template file, falling back to the built-in one"""
         try:
             with open(self.prompt_template_path, 'r', encoding='utf-8') as f:
                 return f.read()
@@ -130,58 +728,54 @@ class ApeManager:
     
     def _get_fallback_prompt_template(self) -> str:
         """Fallback prompt template if external file is not available"""
-        return """I have a Python function that's failing. Please rewrite ONLY the failed function to fix the error.
-
-ERROR DETAILS:
-{error_info}
-
-FAILED FUNCTION SOURCE:
-```python
-{failed_function_source}
-```
-{context_section}
-
-REQUIREMENTS:
-- This function is decorated with @ape_managed
-- Keep the same function name and general purpose  
-- The API endpoint might be fake/broken - you can replace it with a real one
-- Add proper error handling
-- Maintain any comments if possible
-- Consider the data flow and expectations from context functions
-- Return ONLY the fixed function definition (including the @ape_managed decorator)
-
-Please analyze the full call stack context to understand what this function should return and how it fits into the larger program flow."""
+        return _PROMPT_TMPL
+    
+    def get_context_functions(self, failed_func: Callable, traceback_str: str) -> Dict[str, str]:
         """Get source code for all functions in the call stack for context"""
         context_functions = {}
         tb_functions = self.extract_functions_from_traceback(traceback_str)
-        current_module = sys.modules[inspect.getmodule(inspect.stack()[1][0]).__name__]
+        # The failed function's own globals are its module namespace - no stack walk needed
+        lookup = failed_func.__globals__.get
         
         for name in tb_functions:
-            if hasattr(current_module, name):
-                func_obj = getattr(current_module, name)
-                if callable(func_obj):
-                    try:
-                        source = inspect.getsource(func_obj)
-                        context_functions[name] = source
-                    except Exception as e:
-                        context_functions[name] = f"# Could not retrieve source: {e}"
+            func_obj = lookup(name)
+            if func_obj is None or not callable(func_obj):
+                continue
+            try:
+                context_functions[name] = _getsource(func_obj)
+            except Exception as e:
+                context_functions[name] = f"# Could not retrieve source: {e}"
         
         return context_functions
     
-    def request_function_fix(self, func: Callable, error: Exception) -> Optional[str]:
-        """Request APE to fix a specific function that failed"""
-        failed_function_source = self.get_function_source(func._original_function)
+    def _prepare_fix_request(self, func: Callable, error: Exception) -> Optional[tuple]:
+        """
+        Build the cache key, prompt and (err_type, similarity signature) for a
+        failed function (or the @ape_managed wrapper around it)
+        """
+        failed_func = getattr(func, '_original_function', func)
+        failed_function_source = self.get_function_source(failed_func)
         if not failed_function_source:
             return None
         
-        full_traceback = traceback.format_exc()
-        context_functions = self.get_context_functions(func.__name__, full_traceback)
+        import traceback
+        
+        # The traceback starts at the wrapper, so the first frames are the failed function and
+        # its nearest callees; a deep recursion beyond that only adds prompt tokens
+        full_traceback = ''.join(traceback.format_exception(type(error), error, error.__traceback__,
+                                                            limit=_TB_LIMIT))
+        context_functions = self.get_context_functions(failed_func, full_traceback)
+        
+        cache_key = self._fix_cache_key(failed_function_source, error, full_traceback, context_functions)
         
         # Build context section
-        context_section = "\nCONTEXT FUNCTIONS (from call stack):\n"
+        parts = ["\nCONTEXT FUNCTIONS (from call stack):\n"]
+        append = parts.append
+        failed_name = func.__name__
         for name, source in context_functions.items():
-            if name != func.__name__:
-                context_section += f"\n--- {name}() ---\n```python\n{source}\n```\n"
+            if name != failed_name:
+                append(f"\n--- {name}() ---\n```python\n{source}\n```\n")
+        context_section = "".join(parts)
         
         error_info = f"Function: {func.__name__}\nError: {str(error)}\nFull Traceback:\n{full_traceback}"
         
@@ -192,15 +786,24 @@ Please analyze the full call stack context to understand what this function shou
             failed_function_source=failed_function_source,
             context_section=context_section
         )
-
-        headers = {
-            'Content-Type': 'application/json',
-            'x-api-key': self.api_key
-        }
         
-        payload = {
-            "model": self.model,
-            "max_tokens": 1500,
+        # The embedding model only reads the first 256 word pieces, so the similarity
+        # signature is what identifies the failure rather than the whole prompt
+        err_type = type(error).__name__
+        frames = traceback.extract_tb(error.__traceback__)
+        last_frame = f"{frames[-1].name}: {frames[-1].line}\n" if frames else ''
+        signature = f"{err_type}: {error}\n{last_frame}{failed_function_source}"
+        
+        return cache_key, prompt, (err_type, signature)
+    
+    def _build_payload(self, prompt: str, max_tokens: int = 1500) -> Dict[str, Any]:
+        """Wrap a prompt in the LLM request body, stable instructions first"""
+        if 'system' not in self._payload_base:
+            # Other endpoints cache automatically as long as the prefix is identical
+            prompt = f"{SYSTEM_PREFIX}\n{prompt}"
+        return {
+            **self._payload_base,
+            "max_tokens": max_tokens,
             "messages": [
                 {
                     "role": "user", 
@@ -208,26 +811,194 @@ Please analyze the full call stack context to understand what this function shou
                 }
             ]
         }
+    
+    def _read_streamed_reply(self, response) -> str:
+        """
+        Accumulate a server-sent-events reply up to the end of the message. The
+        whole reply is needed, since the fix is its last fence, not its first.
+        Endpoints that ignore "stream": true send a plain JSON body instead.
+        """
+        reply = io.StringIO()
+        other_lines = []
+        saw_event = False
+        
+        # SSE is always UTF-8, whatever charset requests would guess for the response
+        for raw_line in response.iter_lines():
+            line = raw_line.decode('utf-8')
+            if not line.startswith('data:'):
+                if not saw_event:
+                    other_lines.append(line)
+                continue
+            saw_event = True
+            data = line[len('data:'):].strip()
+            if data == '[DONE]':
+                break
+            event = _json_loads(data)
+            if event.get('type') == 'message_stop':
+                break
+            reply.write(_stream_delta_text(event))
+        
+        if not saw_event:
+            return _message_text(_json_loads('\n'.join(other_lines)))
+        return reply.getvalue()
+    
+    def _extract_fixed_code(self, fixed_code: str) -> str:
+        """Pull the fixed function out of an LLM reply"""
+        # Check if APE can't fix this function (special response format)
+        if fixed_code.strip().startswith(_CANNOT_FIX_MARKER):
+            # Extract the explanation after the prefix
+            explanation = fixed_code.strip()[len(_CANNOT_FIX_MARKER):].strip()
+            raise ApeCannotFixError(f"APE cannot fix this function: {explanation}")
+        
+        # Extract function from markdown if present, preferring the last Python fence
+        # since LLMs often show the broken code or a diff before the final version
+        fences = _FENCE_RE.findall(fixed_code)
+        if not fences:
+            return fixed_code.strip()
+        python_fences = [body for tag, body in fences if tag.lower() in _PY_FENCE_TAGS]
+        # Fenced, but nothing in Python - there is no fix to take
+        return python_fences[-1].strip() if python_fences else ''
+    
+    def request_function_fix(self, func: Callable, error: Exception) -> Optional[str]:
+        """Request APE to fix a specific function that failed"""
+        # A fix that was never retried (supervised mode, file update) must not be cached later
+        self._pending_fixes.pop(func.__name__, None)
+        fix_request = self._prepare_fix_request(func, error)
+        if fix_request is None:
+            return None
+        cache_key, prompt, failure = fix_request
+        
+        cached_fix = self._lookup_cached_fix(func.__name__, cache_key, failure)
+        if cached_fix:
+            return cached_fix
+        
+        payload = self._build_payload(prompt)
+        # Streamed so the 60s read timeout applies between tokens rather than to the whole
+        # generation - a long fix keeps the connection alive instead of timing out
+        payload["stream"] = True
         
         try:
-            response = requests.post(self.api_url, headers=headers, json=payload)
-            response.raise_for_status()
+            # The session already sends Content-Type: application/json
+            with self._get_session().post(self.api_url, data=_json_dumps(payload),
+                                       timeout=(3.05, 60), stream=True) as response:
+                response.raise_for_status()
+                fixed_code = self._extract_fixed_code(self._read_streamed_reply(response))
             
-            result = response.json()
-            fixed_code = result['content'][0]['text']
+            if not fixed_code:
+                print(f"😅 APE's reply had no fix for '{func.__name__}'")
+                return None
             
-            # Check if APE can't fix this function (special response format)
-            if fixed_code.strip().startswith("🥹👉👈 I can't fix this one:"):
-                # Extract the explanation after the prefix
-                explanation = fixed_code.strip()[len("🥹👉👈 I can't fix this one:"):].strip()
-                raise ApeCannotFixError(f"APE cannot fix this function: {explanation}")
+            if self.mode == ApeMode.FULL_BANANAS:
+                # Warm the code-object cache now so the hot-swap only has to exec
+                try:
+                    self._compile_fix(func.__name__, fixed_code)
+                except SyntaxError:
+                    pass  # hot_swap_function reports it
             
-            # Extract function from markdown if present
-            if '```python' in fixed_code:
-                start = fixed_code.find('```python') + 9
-                end = fixed_code.find('```', start)
-                fixed_code = fixed_code[start:end].strip()
+            self._pending_fixes[func.__name__] = (cache_key, failure, fixed_code, True)
+            return fixed_code
+            
+        except ApeCannotFixError:
+            # Re-raise APE cannot fix errors
+            raise
+        except Exception as e:
+            print(f"😅 APE API call failed: {e}")
+            return None
+    
+    def _get_session(self):
+        """Lazily create the pooled session so repeated fixes reuse one keep-alive connection"""
+        if self._session is None:
+            # Deferred so programs that never hit a failure don't pay for importing requests
+            import requests
+            from requests.adapters import HTTPAdapter
+            from urllib3.util.retry import Retry
+            
+            # Rate limits and gateway errors are retried here; POST has to be opted in explicitly
+            retries = Retry(
+                total=2,
+                backoff_factor=0.3,
+                status_forcelist=[429, 502, 503, 504],
+                allowed_methods=frozenset(['POST'])
+            )
+            adapter = HTTPAdapter(pool_connections=4, pool_maxsize=8, max_retries=retries)
+            
+            self._session = requests.Session()
+            self._session.mount('https://', adapter)
+            self._session.mount('http://', adapter)
+            self._session.headers.update(self._headers)
+        return self._session
+    
+    async def _get_async_client(self):
+        """Lazily create the httpx client used by async fix requests, one per event loop"""
+        import asyncio
+        loop = asyncio.get_running_loop()
+        if self._aclient is not None and self._aclient_loop is not loop:
+            # Its pooled connections belong to a loop that has since finished (a second
+            # asyncio.run(), say), so they can't be reused from this one
+            old_client, self._aclient = self._aclient, None
+            try:
+                await old_client.aclose()
+            except Exception:
+                pass  # Its loop is already closed; there is nothing left to release
+        
+        if self._aclient is None:
+            try:
+                import httpx
+            except ImportError:
+                raise ApeManagerError(
+                    "httpx is required for async @ape_managed functions. "
+                    "Install it with: pip install 'httpx[http2]'"
+                )
+            client_options = {
+                'headers': self._headers,
+                'timeout': httpx.Timeout(60.0, connect=3.0),
+                'limits': httpx.Limits(max_connections=16, max_keepalive_connections=8)
+            }
+            try:
+                self._aclient = httpx.AsyncClient(http2=True, **client_options)
+            except ImportError:
+                # HTTP/2 needs the optional h2 package; HTTP/1.1 still pools connections
+                self._aclient = httpx.AsyncClient(**client_options)
+            self._aclient_loop = loop
+        return self._aclient
+    
+    async def _send_prompt_async(self, prompt: str, max_tokens: int) -> str:
+        """POST a prompt with the async client and return the reply text"""
+        client = await self._get_async_client()
+        response = await client.post(
+            self.api_url, content=_json_dumps(self._build_payload(prompt, max_tokens))
+        )
+        response.raise_for_status()
+        return _message_text(_json_loads(response.content))
+    
+    async def arequest_function_fix(self, func: Callable, error: Exception) -> Optional[str]:
+        """Async variant of request_function_fix, so concurrent failures overlap their LLM calls"""
+        # A fix that was never retried (supervised mode, file update) must not be cached later
+        self._pending_fixes.pop(func.__name__, None)
+        fix_request = self._prepare_fix_request(func, error)
+        if fix_request is None:
+            return None
+        cache_key, prompt, failure = fix_request
+        
+        cached_fix = self._lookup_cached_fix(func.__name__, cache_key, failure)
+        if cached_fix:
+            return cached_fix
+        
+        try:
+            # Fails fast on a missing httpx; like a missing requests on the sync path, that is
+            # reported and the user's own error is re-raised
+            await self._get_async_client()
+            # Failures landing within the batching window share one LLM round-trip
+            reply = await self.batcher.submit(func.__name__, prompt)
+            if reply is None:
+                print(f"😅 APE's batched reply had no fix for '{func.__name__}'")
+                return None
+            fixed_code = self._extract_fixed_code(reply)
+            if not fixed_code:
+                print(f"😅 APE's reply had no fix for '{func.__name__}'")
+                return None
             
+            self._pending_fixes[func.__name__] = (cache_key, failure, fixed_code, True)
             return fixed_code
             
         except ApeCannotFixError:
@@ -237,48 +1008,117 @@ Please analyze the full call stack context to understand what this function shou
             print(f"😅 APE API call failed: {e}")
             return None
     
+    def _get_func_table(self, path: str, source_text: Optional[str] = None) -> Dict[str, Any]:
+        """Map of module-level function names to AST nodes, rebuilt only when the file changes"""
+        # Integer nanoseconds compare exactly, unlike the float st_mtime
+        mtime = os.stat(path).st_mtime_ns
+        cached = self._ast_cache.get(path)
+        if cached and cached[0] == mtime:
+            return cached[1]
+        
+        if source_text is None:
+            with open(path, 'r') as f:
+                source_text = f.read()
+        
+        func_table = self._parse_func_table(path, source_text)
+        self._ast_cache[path] = (mtime, func_table)
+        return func_table
+    
+    def _parse_func_table(self, path: str, source_text: str) -> Dict[str, Any]:
+        """Parse source into a map of module-level function names to AST nodes"""
+        import ast
+        
+        # @ape_managed functions are module-level, so only the top of the tree is scanned
+        return {
+            node.name: node
+            for node in ast.iter_child_nodes(ast.parse(source_text, filename=path))
+            if isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef))
+        }
+    
+    def _patch_func_table(self, func_table: Dict[str, Any], func_name: str, new_function_code: str,
+                          new_nodes: Dict[str, Any], start_line: int, end_line: int) -> Dict[str, Any]:
+        """
+        Update a function table in place for lines start_line..end_line having been replaced
+        by new_function_code, whose own table is new_nodes. The functions below it just move.
+        """
+        import ast
+        
+        # The replacement is written as new_function_code + '\n\n'
+        delta = new_function_code.count('\n') + 2 - (end_line - start_line)
+        del func_table[func_name]
+        for node in func_table.values():
+            if node.lineno > end_line:
+                ast.increment_lineno(node, delta)
+        for name, node in new_nodes.items():
+            func_table[name] = ast.increment_lineno(node, start_line)
+        return func_table
+    
     def replace_function_in_source(self, func_name: str, new_function_code: str, source_file: str) -> bool:
         """Replace a specific function in the source file with APE's fixed version"""
+        import shutil
+        import tempfile
         try:
-            # Read current source
-            with open(source_file, 'r') as f:
-                source_lines = f.readlines()
+            # Nothing is written unless the fix parses and actually defines the function
+            try:
+                new_nodes = self._parse_func_table(source_file, new_function_code)
+            except SyntaxError as e:
+                print(f"❌ APE's fix for '{func_name}' isn't valid Python ({e}); source left untouched")
+                return False
+            if func_name not in new_nodes:
+                print(f"❌ APE's fix doesn't define '{func_name}'; source left untouched")
+                return False
             
-            # Parse AST to find the function
+            # Create backup on first touch only, so it keeps the pre-APE version of the file.
+            # copyfile copies in the kernel where it can, without pulling the file into memory.
+            if source_file not in self._backed_up:
+                backup_filename = f"{source_file}.backup"
+                shutil.copyfile(source_file, backup_filename)
+                self._backed_up.add(source_file)
+                print(f"📦 Created backup at: {backup_filename}")
+            
+            # Read current source once and derive both the lines and the AST from it
             with open(source_file, 'r') as f:
-                tree = ast.parse(f.read())
+                source_text = f.read()
+            source_lines = source_text.splitlines(keepends=True)
             
             # Find the target function node
-            target_func = None
-            for node in ast.walk(tree):
-                if isinstance(node, ast.FunctionDef) and node.name == func_name:
-                    target_func = node
-                    break
+            func_table = self._get_func_table(source_file, source_text)
+            target_func = func_table.get(func_name)
             
             if not target_func:
                 print(f"❌ Couldn't locate function '{func_name}' in source")
                 return False
             
-            # Calculate line numbers (AST is 1-indexed)
-            start_line = target_func.lineno - 1
+            # Calculate line numbers (AST is 1-indexed), starting at the first
+            # decorator since the fixed code carries its own @ape_managed
+            start_line = min([target_func.lineno] + [d.lineno for d in target_func.decorator_list]) - 1
             end_line = target_func.end_lineno
             
             # Replace the function lines
-            new_source = (
-                source_lines[:start_line] + 
-                [new_function_code + '\n\n'] + 
-                source_lines[end_line:]
-            )
+            new_source = ''.join((
+                ''.join(source_lines[:start_line]),
+                new_function_code + '\n\n',
+                ''.join(source_lines[end_line:])
+            ))
+            del source_lines, source_text
             
-            # Create backup
-            backup_filename = f"{source_file}.backup"
-            with open(backup_filename, 'w') as backup:
-                backup.writelines(source_lines)
-            print(f"📦 Created backup at: {backup_filename}")
+            # Write the updated source to a temp file and swap it in, so a crash
+            # mid-write can never leave a half-written module behind
+            with tempfile.NamedTemporaryFile('w', dir=os.path.dirname(os.path.abspath(source_file)),
+                                             suffix='.tmp', delete=False) as tmp:
+                tmp.write(new_source)
+            try:
+                shutil.copymode(source_file, tmp.name)
+                os.replace(tmp.name, source_file)
+            except Exception:
+                # Don't leave a stray .tmp next to the user's module
+                os.unlink(tmp.name)
+                raise
             
-            # Write the updated source
-            with open(source_file, 'w') as f:
-                f.writelines(new_source)
+            # Keep the table valid for the rewritten file, so the next swap here needn't re-parse it
+            self._patch_func_table(func_table, func_name, new_function_code, new_nodes,
+                                   start_line, end_line)
+            self._ast_cache[source_file] = (os.stat(source_file).st_mtime_ns, func_table)
             
             print(f"✅ Successfully replaced function '{func_name}'!")
             return True
@@ -287,18 +1127,36 @@ Please analyze the full call stack context to understand what this function shou
             print(f"💀 Failed to replace function: {e}")
             return False
     
+    def _compile_fix(self, func_name: str, new_function_code: str) -> types.CodeType:
+        """Compile fixed code once, reusing the code object if the same fix comes back"""
+        filename = f'<ape_hotswap:{func_name}>'
+        # A collision here would exec the wrong code, so use a real digest rather than hash()
+        import hashlib
+        key = hashlib.blake2b(new_function_code.encode(), digest_size=16).digest()
+        code_obj = self._code_cache.get(key)
+        if code_obj is None:
+            code_obj = compile(new_function_code, filename, 'exec')
+            self._code_cache[key] = code_obj
+        
+        # Register the source so tracebacks and later repairs can see the swapped code
+        linecache.cache[filename] = (
+            len(new_function_code), None, new_function_code.splitlines(keepends=True), filename
+        )
+        return code_obj
+    
     def hot_swap_function(self, func_name: str, new_function_code: str, caller_module) -> Optional[Callable]:
         """
         Hot-swap a function in memory by executing the new code and replacing the function.
         Returns the new function if successful, None otherwise.
         """
         try:
-            # Prepare execution context with the caller's globals
-            exec_globals = caller_module.__dict__.copy()
+            # Execute against the module's live globals - names only need resolving, and the
+            # new definition lands in exec_locals until it is explicitly set on the module
+            exec_globals = caller_module.__dict__
             exec_locals = {}
             
             # Execute the new function code
-            exec(new_function_code, exec_globals, exec_locals)
+            exec(self._compile_fix(func_name, new_function_code), exec_globals, exec_locals)
             
             # Find the newly defined function
             new_func = None
@@ -329,12 +1187,222 @@ Please analyze the full call stack context to understand what this function shou
             return None
 
 
-# Global APE manager instance
-try:
-    _ape_manager = ApeManager()
-except ApeManagerError as e:
-    print(f"❌ APE Manager initialization failed: {e}")
-    sys.exit(1)
+# Failures APE must never rewrite code for. KeyboardInterrupt and SystemExit need no
+# entry: they aren't Exception subclasses, so the wrappers never catch them at all.
+_NON_FIXABLE = (MemoryError,)
+
+# Failures a rewrite of the function body can plausibly fix
+# (ImportError covers ModuleNotFoundError; SYSTEM_PREFIX asks for a working alternative)
+_FIXABLE = (AttributeError, KeyError, TypeError, ValueError, IndexError, NameError, ArithmeticError,
+            ImportError)
+
+# Plain retries given to network errors before escalating to APE
+_TRANSIENT_RETRIES = 2
+
+
+def _is_transient_error(error: Exception) -> bool:
+    """Check for connection/timeout errors that may succeed if simply retried"""
+    if isinstance(error, (ConnectionError, TimeoutError)):
+        return True
+    # Only an already-imported requests can have raised one of its exceptions
+    requests = sys.modules.get('requests')
+    return requests is not None and isinstance(
+        error, (requests.exceptions.ConnectionError, requests.exceptions.Timeout)
+    )
+
+
+def _is_fixable_error(error: Exception) -> bool:
+    """Check whether a failure is worth an LLM rewrite"""
+    if isinstance(error, _FIXABLE) or _is_transient_error(error):
+        # Network errors that outlast their retries may come from a broken endpoint in the code
+        return True
+    # Likewise an HTTP error status from raise_for_status() on a wrong or fake URL
+    requests = sys.modules.get('requests')
+    return requests is not None and isinstance(error, requests.exceptions.HTTPError)
+
+
+# Global APE manager instance, created on first use
+_ape_manager = None
+
+
+def _get_manager() -> ApeManager:
+    """Return the global APE manager, creating it the first time it is needed"""
+    global _ape_manager
+    if _ape_manager is None:
+        try:
+            _ape_manager = ApeManager()
+        except ApeManagerError as e:
+            print(f"❌ APE Manager initialization failed: {e}")
+            sys.exit(1)
+    return _ape_manager
+
+
+def _copy_function_metadata(wrapper: Callable, func: Callable) -> None:
+    """
+    The subset of functools.wraps that @ape_managed needs, without the
+    __annotations__/__dict__ copying, since it runs for every decorated function.
+    """
+    wrapper.__name__ = func.__name__
+    wrapper.__qualname__ = func.__qualname__
+    wrapper.__module__ = func.__module__
+    wrapper.__doc__ = func.__doc__
+    wrapper.__wrapped__ = func
+
+
+def _triage_failure(func: Callable, error: Exception, retry_count: int, max_retries: int,
+                    backoff_count: int) -> Optional[float]:
+    """
+    Decide what to do about a failed call. Re-raises the error if it shouldn't be
+    retried, returns a delay for a plain retry, or None when APE should rewrite it.
+    """
+    if isinstance(error, _NON_FIXABLE):
+        raise error
+    
+    if retry_count >= max_retries:
+        print(f"❌ Max retries ({max_retries}) reached for '{func.__name__}'. Giving up.")
+        raise error
+    
+    if _is_transient_error(error) and backoff_count < _TRANSIENT_RETRIES:
+        # Network hiccups usually clear up on their own - retry before paying for a rewrite
+        delay = 2 ** backoff_count * 0.5
+        print(f"🌐 '{func.__name__}' hit a transient error: {error}. Retrying in {delay:.1f}s...")
+        return delay
+    
+    if not _is_fixable_error(error):
+        print(f"🙈 '{func.__name__}' raised {type(error).__name__}, which isn't something a rewrite can fix.")
+        raise error
+    
+    print(f"💥 @ape_managed function '{func.__name__}' failed (attempt {retry_count + 1}): {error}")
+    print("🤖 Requesting APE assistance for function repair...")
+    return None
+
+
+def _report_cannot_fix(cannot_fix_error: ApeCannotFixError) -> None:
+    """Tell the user APE has handed the problem back to them"""
+    print(f"🚨 {cannot_fix_error}")
+    print("👨‍💻 Human intervention required - this is not something APE can fix automatically.")
+
+
+def _apply_fix(func: Callable, fixed_function: Optional[str], defining_module) -> Optional[Callable]:
+    """
+    Act on APE's fix according to the configured mode.
+    Returns the function to retry with, or None if the call should not be retried.
+    """
+    if not fixed_function:
+        print(f"🥹👉👈 APE couldn't fix '{func.__name__}'. Manual intervention required.")
+        return None
+    
+    manager = _get_manager()
+    if manager.mode == ApeMode.FULL_BANANAS:
+        # Full automatic mode - hot-swap and retry
+        new_func = manager.hot_swap_function(func.__name__, fixed_function, defining_module)
+        if new_func:
+            print(f"🔧 Function '{func.__name__}' has been hot-swapped!")
+            print("🔄 Retrying with the fixed function...")
+            return getattr(new_func, '_original_function', new_func)
+        
+        # Fall back to file replacement
+        import inspect
+        source_file = inspect.getfile(func)
+        if manager.replace_function_in_source(func.__name__, fixed_function, source_file):
+            print(f"🔧 Function '{func.__name__}' has been updated in source!")
+            print("🔄 Please restart the program to use the fixed version.")
+        else:
+            print(f"🥹👉👈 Both hot-swap and file update failed for '{func.__name__}'.")
+    
+    elif manager.mode == ApeMode.APE_SUPERVISED:
+        # Supervised mode - log suggestion and stop
+        print(f"🐒 APE SUPERVISED MODE - Suggested fix for '{func.__name__}':")
+        print("=" * 60)
+        print(fixed_function)
+        print("=" * 60)
+        print("📝 To apply this fix:")
+        print(f"   1. Replace the '{func.__name__}' function with the code above")
+        print("   2. Restart your program")
+        print("   3. Test the fix")
+    
+    return None
+
+
+def _handle_ape_failure(func: Callable, error: Exception, args: tuple, kwargs: dict) -> Any:
+    """Retry/repair loop for a failed @ape_managed call, kept off the success path"""
+    max_retries = 2  # Prevent infinite loops
+    retry_count = 0
+    backoff_count = 0
+    current_func = func
+    # func.__module__ names the defining module outright - no frame walking or getmodule() scan
+    defining_module = sys.modules.get(func.__module__)
+    
+    while True:
+        delay = _triage_failure(func, error, retry_count, max_retries, backoff_count)
+        if delay is not None:
+            time.sleep(delay)
+            backoff_count += 1
+        else:
+            # Attempt to get APE to fix just this function
+            try:
+                # The version that just failed, which after a hot-swap is APE's previous fix
+                fixed_function = _get_manager().request_function_fix(current_func, error)
+            except ApeCannotFixError as cannot_fix_error:
+                _report_cannot_fix(cannot_fix_error)
+                raise
+            
+            current_func = _apply_fix(func, fixed_function, defining_module)
+            if current_func is None:
+                raise error
+            retry_count += 1
+        
+        try:
+            result = current_func(*args, **kwargs)
+        except Exception as e:
+            if retry_count:
+                _get_manager().settle_fix(func.__name__, succeeded=False)
+            error = e
+        else:
+            if retry_count:
+                _get_manager().settle_fix(func.__name__, succeeded=True)
+            return result
+
+
+async def _ahandle_ape_failure(func: Callable, error: Exception, args: tuple, kwargs: dict) -> Any:
+    """Async counterpart of _handle_ape_failure for coroutine functions"""
+    max_retries = 2  # Prevent infinite loops
+    retry_count = 0
+    backoff_count = 0
+    current_func = func
+    # func.__module__ names the defining module outright - no frame walking or getmodule() scan
+    defining_module = sys.modules.get(func.__module__)
+    
+    while True:
+        delay = _triage_failure(func, error, retry_count, max_retries, backoff_count)
+        if delay is not None:
+            import asyncio
+            await asyncio.sleep(delay)
+            backoff_count += 1
+        else:
+            # Attempt to get APE to fix just this function
+            try:
+                # The version that just failed, which after a hot-swap is APE's previous fix
+                fixed_function = await _get_manager().arequest_function_fix(current_func, error)
+            except ApeCannotFixError as cannot_fix_error:
+                _report_cannot_fix(cannot_fix_error)
+                raise
+            
+            current_func = _apply_fix(func, fixed_function, defining_module)
+            if current_func is None:
+                raise error
+            retry_count += 1
+        
+        try:
+            result = await current_func(*args, **kwargs)
+        except Exception as e:
+            if retry_count:
+                _get_manager().settle_fix(func.__name__, succeeded=False)
+            error = e
+        else:
+            if retry_count:
+                _get_manager().settle_fix(func.__name__, succeeded=True)
+            return result
 
 
 def ape_managed(func: Callable) -> Callable:
@@ -347,106 +1415,60 @@ def ape_managed(func: Callable) -> Callable:
     - APE_API_URL: The LLM service endpoint (e.g., https://api.anthropic.com/v1/messages)
     - APE_API_KEY: Your LLM service API key
     - APE_MODEL: (Optional) The model to use (defaults to claude-3-sonnet-20240229)
+    
+    Coroutine functions are routed to ape_managed_async automatically.
     """
-    @wraps(func)
+    if _is_coroutine_function(func):
+        return ape_managed_async(func)
+    
     def wrapper(*args, **kwargs):
-        max_retries = 2  # Prevent infinite loops
-        retry_count = 0
-        
-        while retry_count <= max_retries:
-            try:
-                # Get the current function to call (might be updated from previous retry)
-                caller_frame = inspect.currentframe().f_back
-                caller_module = inspect.getmodule(caller_frame)
-                current_func = getattr(caller_module, func.__name__, func)
-                
-                # If this is the original function, call it directly
-                if retry_count == 0:
-                    return func(*args, **kwargs)
-                else:
-                    # For retries, call the updated function
-                    if hasattr(current_func, '_original_function'):
-                        return current_func._original_function(*args, **kwargs)
-                    else:
-                        return current_func(*args, **kwargs)
-                        
-            except Exception as e:
-                if retry_count >= max_retries:
-                    print(f"❌ Max retries ({max_retries}) reached for '{func.__name__}'. Giving up.")
-                    raise e
-                
-                print(f"💥 @ape_managed function '{func.__name__}' failed (attempt {retry_count + 1}): {e}")
-                print("🤖 Requesting APE assistance for function repair...")
-                
-                # Attempt to get APE to fix just this function
-                try:
-                    fixed_function = _ape_manager.request_function_fix(wrapper, e)
-                except ApeCannotFixError as cannot_fix_error:
-                    print(f"🚨 {cannot_fix_error}")
-                    print("👨‍💻 Human intervention required - this is not something APE can fix automatically.")
-                    raise cannot_fix_error
-                
-                if fixed_function:
-                    if _ape_manager.mode == ApeMode.FULL_BANANAS:
-                        # Full automatic mode - hot-swap and retry
-                        caller_frame = inspect.currentframe().f_back
-                        caller_module = inspect.getmodule(caller_frame)
-                        
-                        # Try hot-swapping first
-                        new_func = _ape_manager.hot_swap_function(func.__name__, fixed_function, caller_module)
-                        if new_func:
-                            print(f"🔧 Function '{func.__name__}' has been hot-swapped!")
-                            print("🔄 Retrying with the fixed function...")
-                            retry_count += 1
-                            continue
-                        else:
-                            # Fall back to file replacement
-                            source_file = inspect.getfile(caller_frame)
-                            if _ape_manager.replace_function_in_source(func.__name__, fixed_function, source_file):
-                                print(f"🔧 Function '{func.__name__}' has been updated in source!")
-                                print("🔄 Please restart the program to use the fixed version.")
-                            else:
-                                print(f"🥹👉👈 Both hot-swap and file update failed for '{func.__name__}'.")
-                            break
-                    
-                    elif _ape_manager.mode == ApeMode.APE_SUPERVISED:
-                        # Supervised mode - log suggestion and stop
-                        print(f"🐒 APE SUPERVISED MODE - Suggested fix for '{func.__name__}':")
-                        print("=" * 60)
-                        print(fixed_function)
-                        print("=" * 60)
-                        print("📝 To apply this fix:")
-                        print(f"   1. Replace the '{func.__name__}' function with the code above")
-                        print("   2. Restart your program")
-                        print("   3. Test the fix")
-                        break
-                else:
-                    print(f"🥹👉👈 APE couldn't fix '{func.__name__}'. Manual intervention required.")
-                    break
-        
-        # If we get here, all retries failed
-        raise e
+        # Successful calls cost one try block; everything else lives in the failure handler
+        try:
+            return func(*args, **kwargs)
+        except Exception as e:
+            error = e
+        # Handled outside the except block, so later failures don't chain onto this one
+        return _handle_ape_failure(func, error, args, kwargs)
+    
+    _copy_function_metadata(wrapper, func)
+    
+    # Register this function as APE-managed
+    _get_manager().register_function(func)
+    wrapper._is_ape_managed = True
+    wrapper._original_function = func
+    
+    return wrapper
+
+
+def ape_managed_async(func: Callable) -> Callable:
+    """
+    Async variant of @ape_managed for coroutine functions.
+    Fix requests are awaited rather than blocking, so several managed
+    coroutines failing at once have their LLM calls in flight together.
+    """
+    async def wrapper(*args, **kwargs):
+        try:
+            return await func(*args, **kwargs)
+        except Exception as e:
+            error = e
+        # Handled outside the except block, so later failures don't chain onto this one
+        return await _ahandle_ape_failure(func, error, args, kwargs)
+    
+    _copy_function_metadata(wrapper, func)
     
     # Register this function as APE-managed
-    _ape_manager.register_function(func)
+    _get_manager().register_function(func)
     wrapper._is_ape_managed = True
     wrapper._original_function = func
     
     return wrapper
 
 
-def get_managed_functions() -> Dict[str, Callable]:
-    """Get all currently APE-managed functions"""
-    return _ape_manager.managed_functions.copy()
+def get_managed_functions() -> Mapping[str, Callable]:
+    """Get a read-only view of all currently APE-managed functions"""
+    return types.MappingProxyType(_get_manager().managed_functions)
 
 
-def get_manager_status() -> Dict[str, Any]:
+def get_manager_status() -> Mapping[str, Any]:
     """Get status information about the APE manager"""
-    return {
-        'api_url': _ape_manager.api_url,
-        'model': _ape_manager.model,
-        'mode': _ape_manager.mode.value,
-        'prompt_template_path': _ape_manager.prompt_template_path,
-        'managed_function_count': len(_ape_manager.managed_functions),
-        'managed_functions': list(_ape_manager.managed_functions.keys())
-    }
\ No newline at end of file
+    return _get_manager().get_status()